@@ -0,0 +1,28 @@
+import numpy as np
+from numba import njit, prange
+
+@njit(parallel=True, cache=True)
+def decode_pcm(buf, bits_per_sample, channels, out) -> None:
+    '''
+    Assemble little-endian PCM bytes into a preallocated (samples, channels) int32 array
+    Covers widths without a native numpy dtype (24 bit), as well as 8, 16, and 32 bit
+    8 bit samples are unsigned and are kept as-is, matching the uint8 read path
+    '''
+    bytes_per_sample = bits_per_sample // 8
+    num_samples = out.shape[0]
+
+    for sample_number in prange(num_samples):
+        for channel_number in range(channels):
+            start = (sample_number * channels + channel_number) * bytes_per_sample
+
+            # Most significant byte carries the sign for all signed widths
+            if bytes_per_sample == 1:
+                sample = np.int32(buf[start])
+            elif bytes_per_sample == 2:
+                sample = np.int32(buf[start]) | (np.int32(np.int8(buf[start + 1])) << 8)
+            elif bytes_per_sample == 3:
+                sample = np.int32(buf[start]) | (np.int32(buf[start + 1]) << 8) | (np.int32(np.int8(buf[start + 2])) << 16)
+            else:
+                sample = np.int32(buf[start]) | (np.int32(buf[start + 1]) << 8) | (np.int32(buf[start + 2]) << 16) | (np.int32(np.int8(buf[start + 3])) << 24)
+
+            out[sample_number, channel_number] = sample
@@ -1,5 +1,13 @@
 import numpy as np
 
+# Precision contract for isolation:
+#   amplitudes enter and leave in the wav's integer dtype,
+#   model math runs in half precision to halve memory traffic,
+#   and windowing coefficients stay in single precision for numerical safety
+# Rescaling back to integers must clip in double precision, float32 cannot represent 2**31 - 1
+COMPUTE_DTYPE = np.float16
+WINDOW_DTYPE = np.float32
+
 class Decomposer():
     '''
     Isolate desired source from original amplitudes array
@@ -7,53 +15,59 @@ class Decomposer():
     def __init__(self) -> None:
         pass
 
-    def decompose(self, amplitudes, source) -> np.array:
+    def decompose(self, amplitudes, source, out=None) -> np.array:
+        '''
+        Return the isolated amplitudes for a source, shaped (samples, channels) like the input
+        Isolators may return amplitudes itself (or a view of it) when no work is needed, so the result
+        must be treated as read-only; otherwise a new array is returned. Callers should not copy it
+        If out is given, isolators that compute a result write it there and return out instead of allocating
+        '''
         if source == "bass":
-            isolated_amplitudes = self.isolate_bass(amplitudes)
+            isolated_amplitudes = self.isolate_bass(amplitudes, out)
         if source == "guitar":
-            isolated_amplitudes = self.isolate_bass(amplitudes)
+            isolated_amplitudes = self.isolate_guitar(amplitudes, out)
         if source == "vocals":
-            isolated_amplitudes = self.isolate_bass(amplitudes)
+            isolated_amplitudes = self.isolate_vocals(amplitudes, out)
         if source == "drums":
-            isolated_amplitudes = self.isolate_bass(amplitudes)
+            isolated_amplitudes = self.isolate_drums(amplitudes, out)
         if source == "synth":
-            isolated_amplitudes = self.isolate_bass(amplitudes)
+            isolated_amplitudes = self.isolate_synth(amplitudes, out)
         if source == "brass":
-            isolated_amplitudes = self.isolate_bass(amplitudes)
+            isolated_amplitudes = self.isolate_brass(amplitudes, out)
 
         return isolated_amplitudes
 
-    def isolate_bass(self, amplitudes) -> np.array:
+    def isolate_bass(self, amplitudes, out=None) -> np.array:
         """
         To-do
         """
         return amplitudes
 
-    def isolate_guitar(self, amplitudes) -> np.array:
+    def isolate_guitar(self, amplitudes, out=None) -> np.array:
         """
         To-do
         """
         return amplitudes
 
-    def isolate_vocals(self, amplitudes) -> np.array:
+    def isolate_vocals(self, amplitudes, out=None) -> np.array:
         """
         To-do
         """
         return amplitudes
 
-    def isolate_drums(self, amplitudes) -> np.array:
+    def isolate_drums(self, amplitudes, out=None) -> np.array:
         """
         To-do
         """
         return amplitudes
 
-    def isolate_synth(self, amplitudes) -> np.array:
+    def isolate_synth(self, amplitudes, out=None) -> np.array:
         """
         To-do
         """
         return amplitudes
 
-    def isolate_brass(self, amplitudes) -> np.array:
+    def isolate_brass(self, amplitudes, out=None) -> np.array:
         """
         To-do
         """
@@ -1,14 +1,19 @@
 import sys
 import os
+import logging
+
+log = logging.getLogger(__name__)
 
 class Flags():
     def __init__(self) -> None:
 
-        sys.stdout.write("[Info] =::::= Parsing flags\n")
+        log.info("Parsing flags")
         self.input = None
         self.output = None
         self.source = []
-        self.valid_instruments = ['bass', 'guitar', 'vocals', 'drums', 'synth', 'brass']
+        self.plot = False
+        self.plot_file = None
+        self.valid_instruments = frozenset({'bass', 'guitar', 'vocals', 'drums', 'synth', 'brass'})
         self.args = sys.argv[1:]
         if "-help" in self.args:
             sys.stdout.write(
@@ -17,32 +22,50 @@ class Flags():
 Run the main script siren.py with the following flags:
     -input  :: followed by your input .wav audio file.
     -output :: followed by your output directory.
-    -source :: followed by each desired isolated track, from the list: [vocals, bass, drums, brass, synth, drums]\n
+    -source :: followed by each desired isolated track, from the list: [vocals, bass, drums, brass, synth, drums]
+    -plot   :: (optional) plot the isolated waveform, saved to a following .png file if given, otherwise shown\n
 An example call to this program that seeks to isolate the drums and synth from a stem would be:
 python3 siren.py -input mixed.wav -output isolated_sources/ -source drums synth\n\n''')
             sys.exit(0)
 
-        # Parse each argument
-        for index, arg in enumerate(self.args):
+        # Parse each argument, advancing past the values consumed by each flag
+        index = 0
+        while index < len(self.args):
+            arg = self.args[index]
+            index += 1
 
             if arg == "-input":
-                if self.args[index+1].endswith(".wav"):
-                    self.input = self.args[index+1]
+                if index < len(self.args) and self.args[index].endswith(".wav"):
+                    self.input = self.args[index]
+                    index += 1
                 else:
                     raise TypeError("Invalid input argument. Use '-input input.wav")
-                
-            if arg == "-output":
-                if os.path.isdir(self.args[index + 1]):
-                    self.output = self.args[index+1]
+
+            elif arg == "-output":
+                if index < len(self.args) and os.path.isdir(self.args[index]):
+                    self.output = self.args[index]
+                    index += 1
                 else:
                     raise TypeError ("Invalid output directory.")
 
-            if arg == "-source":
-                for instrument in self.args[index+1:]:
+            elif arg == "-source":
+                # Sources run until the next flag
+                while index < len(self.args) and not self.args[index].startswith("-"):
+                    instrument = self.args[index]
                     if instrument in self.valid_instruments:
                         self.source.append(instrument)
                     else:
                         raise TypeError("Invalid source argument. Please select from the list:\n - bass\n - guitar\n - vocals\n - drums\n - synth\n - brass")
+                    index += 1
+
+            elif arg == "-plot":
+                self.plot = True
+                if index < len(self.args) and self.args[index].endswith(".png"):
+                    self.plot_file = self.args[index]
+                    index += 1
+
+            else:
+                raise TypeError(f"Unrecognized argument '{arg}'. Use '-help' for usage")
 
         # Ensure all necessary flags were passed in
         if self.input == None:
@@ -53,6 +76,8 @@ python3 siren.py -input mixed.wav -output isolated_sources/ -source drums synth\
             raise TypeError("Invalid source argument. Use '-source [instrument_i] (for all i)")
 
         # Report processed flags
-        sys.stdout.write(f"Input file:         {self.input}\n")
-        sys.stdout.write(f"Output directory:   {self.output}\n")
-        sys.stdout.write(f"Sampled sources:    {self.source}\n\n")
\ No newline at end of file
+        log.info("Processed flags:\n"
+                 "Input file:         %s\n"
+                 "Output directory:   %s\n"
+                 "Sampled sources:    %s",
+                 self.input, self.output, self.source)
\ No newline at end of file
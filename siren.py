@@ -1,8 +1,10 @@
 from waveform import Waveform
 from flags import Flags
-import matplotlib.pyplot as plt
+import logging
 
 def main():
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
+
     # Contains input, output, and source
     argument_flags = Flags()
 
@@ -12,16 +14,36 @@ def main():
     # Split tracks and save output
     waveform.split(argument_flags.output, argument_flags.source)
 
-    # Test plot
+    # Plotting is opt-in, keeping matplotlib out of batch runs
+    if argument_flags.plot:
+        plot(waveform, argument_flags.plot_file)
+
+def plot(waveform, plot_file=None):
+    '''
+    Plot each channel of the last isolated track
+    Saved to plot_file without a display if given, otherwise shown interactively
+    '''
+    import matplotlib
+    if plot_file is not None:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    # Downsampled since the display cannot resolve more points than this
+    stride = max(1, waveform.num_samples // 50_000)
+    display_amplitudes = waveform.isolated_amplitudes[::stride]
     if waveform.audio_channels > 1:
         fig, axs = plt.subplots(waveform.audio_channels, 1, figsize=(10, 8))    
         for channel_number in range(waveform.audio_channels):
-            axs[channel_number].plot(waveform.isolated_amplitudes[:, channel_number], linewidth=0.5)
+            axs[channel_number].plot(display_amplitudes[:, channel_number], linewidth=0.5)
             axs[channel_number].set_title(f'Channel {channel_number+1}')
     else:
-        plt.plot(waveform.isolated_amplitudes, linewidth=0.5)
+        plt.plot(display_amplitudes, linewidth=0.5)
         plt.title(f'Channel 1')
-    plt.show()
+
+    if plot_file is not None:
+        plt.savefig(plot_file)
+    else:
+        plt.show()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,8 +1,85 @@
 import struct
 import numpy as np
-import sys
+import os
+import logging
+from functools import lru_cache, cached_property
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from queue import SimpleQueue
 from decompose import Decomposer
 
+log = logging.getLogger(__name__)
+
+# Little-endian numpy dtype of the amplitudes for each supported bits per sample
+# No native 24 bit dtype exists, so those samples are widened into int32
+_PCM_DTYPES = {
+    8: np.dtype('<u1'),
+    16: np.dtype('<i2'),
+    24: np.dtype('<i4'),
+    32: np.dtype('<i4'),
+}
+
+# fmt block audio formats, with the GUID marking PCM inside an extensible fmt block
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+_KSDATAFORMAT_SUBTYPE_PCM = b'\x01\x00\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+
+# Fields read from the RIFF, fmt, and data block headers, with the offset of the amplitudes
+_WavHeader = namedtuple('_WavHeader', [
+    'riff_id', 'file_size', 'wave_id',
+    'fmt_id', 'fmt_size', 'audio_format', 'audio_channels', 'sample_rate', 'byte_rate', 'block_align', 'bits_per_sample',
+    'data_id', 'data_size', 'data_offset',
+])
+
+@lru_cache(maxsize=128)
+def _parse_header(path, mtime_ns, size) -> _WavHeader:
+    '''
+    Read the RIFF, fmt, and data block headers of a .wav file
+    Keyed on modification time and size so an edited file is re-parsed
+    data_size is returned as declared, even if the file holds less
+    '''
+    with open(path, 'rb') as file:
+        # RIFF Block
+        riff_header = file.read(12)
+        if len(riff_header) < 12:
+            raise ValueError(f"Error: {path} is too short to be a RIFF/WAVE file")
+        riff_id, file_size, wave_id = struct.unpack('<4sI4s', riff_header)
+        if riff_id != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"Error: {path} is not a RIFF/WAVE file")
+
+        # fmt Block
+        fmt_id, fmt_size = Waveform.jump_to(b'fmt ', file)
+        if fmt_size < 16:
+            raise ValueError(f"Error: fmt block size of {fmt_size} is too small for PCM fields")
+        fmt_fields = file.read(16)
+        if len(fmt_fields) < 16:
+            raise ValueError(f"Error: {path} ends inside its fmt block")
+        (audio_format, audio_channels, sample_rate,
+         byte_rate, block_align, bits_per_sample) = struct.unpack('<HHIIHH', fmt_fields)
+        if audio_channels == 0:
+            raise ValueError(f"Error: {path} declares 0 audio channels")
+
+        # Extension bytes past the 16 byte PCM fields, carrying the subformat of extensible files
+        fmt_extension = file.read(fmt_size - 16)
+        if len(fmt_extension) < fmt_size - 16:
+            raise ValueError(f"Error: {path} ends inside its fmt block")
+
+        # Only integer PCM is decoded, directly or wrapped in WAVE_FORMAT_EXTENSIBLE
+        if audio_format == _WAVE_FORMAT_EXTENSIBLE:
+            if len(fmt_extension) < 24 or fmt_extension[8:24] != _KSDATAFORMAT_SUBTYPE_PCM:
+                raise ValueError(f"Error: {path} is an extensible wav file without a PCM subformat. Only PCM wav files are supported")
+        elif audio_format != _WAVE_FORMAT_PCM:
+            raise ValueError(f"Error: Audio format {audio_format} of {path} not supported. Only PCM wav files are supported")
+
+        # Data Block, amplitudes begin immediately after its header
+        data_id, data_size = Waveform.jump_to(b'data', file)
+        data_offset = file.tell()
+
+    return _WavHeader(riff_id, file_size, wave_id,
+                      fmt_id, fmt_size, audio_format, audio_channels, sample_rate, byte_rate, block_align, bits_per_sample,
+                      data_id, data_size, data_offset)
+
 class Waveform():
     '''
     Open a .wav audio file and read binary information to extract data.
@@ -26,135 +103,267 @@ class Waveform():
     '''
     def __init__(self, input_directory) -> None:
 
-        sys.stdout.write(f"[Info] =::::= Reading file - {input_directory}\n")
+        log.info("Reading file - %s", input_directory)
 
         self.input_directory = input_directory
 
-        with open(input_directory, 'rb') as file:
-            # RIFF Block
-            self.riff_id, self.file_size = self.jump_to(b'RIFF', file)
-            self.wave_id = file.read(4)
-
-            # fmt Block
-            self.fmt_id, self.fmt_size = self.jump_to(b'fmt ', file)
-            self.audio_format = struct.unpack('<H', file.read(2))[0]
-            self.audio_channels = struct.unpack('<H', file.read(2))[0]
-            self.sample_rate = struct.unpack('<I', file.read(4))[0]
-            self.byte_rate = struct.unpack('<I', file.read(4))[0]
-            self.block_align = struct.unpack('<H', file.read(2))[0]
-            self.bits_per_sample = struct.unpack('<H', file.read(2))[0]
-            self.bytes_per_sample = self.bits_per_sample // 8
-            if self.bits_per_sample not in [8, 16, 32]:
-                raise ValueError(f"Error: Bits Per Sample of {self.bits_per_sample} not supported. Only 8, 16, and 32 bit wav files are supported")
-
-            # Data Block
-            self.data_id, self.data_size = self.jump_to(b'data', file)
-            self.bit_rate = self.bits_per_sample * self.sample_rate
-            self.num_samples = self.data_size // (self.bytes_per_sample * self.audio_channels)
-
-            # Determine sample format and numpy dtype
-            if self.bits_per_sample == 8:
-                self.sample_format = '<B'
-                self.amplitudes = np.empty((self.num_samples, self.audio_channels), dtype=np.uint8)
-            if self.bits_per_sample == 16:
-                self.sample_format = '<h'
-                self.amplitudes = np.empty((self.num_samples, self.audio_channels), dtype=np.int16)
-            elif self.bits_per_sample == 32:
-                self.sample_format = '<i'
-                self.amplitudes = np.empty((self.num_samples, self.audio_channels), dtype=np.int32)
-
-            # Read raw data
-            sys.stdout.write("[DEBUG] ::::  Reading data block - Status: ")
-            sys.stdout.flush()
-            raw_data = file.read(self.data_size)
-
-            # Read from file data into each channel's amplitude array
-            for sample_number in range(self.num_samples):
-                for channel_number in range(self.audio_channels):
-                    start = (sample_number * self.audio_channels + channel_number) * self.bytes_per_sample
-                    sample = struct.unpack(self.sample_format, raw_data[start:start + self.bytes_per_sample])[0]
-                    self.amplitudes[sample_number, channel_number] = sample
-            sys.stdout.write("Finished\n")
+        # Header fields are cached per file version, so repeat opens skip the block walk
+        file_stat = os.stat(input_directory)
+        header = _parse_header(os.path.abspath(input_directory), file_stat.st_mtime_ns, file_stat.st_size)
+        self.riff_id = header.riff_id
+        self.file_size = header.file_size
+        self.wave_id = header.wave_id
+        self.fmt_id = header.fmt_id
+        self.fmt_size = header.fmt_size
+        self.audio_format = header.audio_format
+        self.audio_channels = header.audio_channels
+        self.sample_rate = header.sample_rate
+        self.byte_rate = header.byte_rate
+        self.block_align = header.block_align
+        self.bits_per_sample = header.bits_per_sample
+        self.data_id = header.data_id
+        self.data_size = header.data_size
+        self.data_offset = header.data_offset
+
+        # Truncated recordings and unpatched streaming writers declare more data than is present
+        available_size = file_stat.st_size - self.data_offset
+        if self.data_size > available_size:
+            log.warning("Data block of %s declares %d bytes but only %d are present, reading those", input_directory, self.data_size, available_size)
+            self.data_size = available_size
+
+        self.bytes_per_sample = self.bits_per_sample // 8
+        try:
+            self.sample_dtype = _PCM_DTYPES[self.bits_per_sample]
+        except KeyError:
+            raise ValueError(f"Error: Bits Per Sample of {self.bits_per_sample} not supported. Only 8, 16, 24, and 32 bit wav files are supported") from None
+        self.bit_rate = self.bits_per_sample * self.sample_rate
+        self.num_samples = self.data_size // (self.bytes_per_sample * self.audio_channels)
+
+        # Map data block from disk as a (samples, channels) amplitude array, paged in lazily by the OS
+        log.debug("Mapping data block")
+        if self.bits_per_sample == 24:
+            # Packed samples must be assembled byte-wise by the compiled decoder
+            from decode import decode_pcm
+            raw_data = np.memmap(input_directory, dtype=np.uint8, mode='r', offset=self.data_offset, shape=(self.num_samples * self.audio_channels * self.bytes_per_sample,))
+            self.amplitudes = np.empty((self.num_samples, self.audio_channels), dtype=self.sample_dtype)
+            decode_pcm(raw_data, self.bits_per_sample, self.audio_channels, self.amplitudes)
+        else:
+            self.amplitudes = np.memmap(input_directory, dtype=self.sample_dtype, mode='r', offset=self.data_offset, shape=(self.num_samples, self.audio_channels))
+        log.debug("Mapped data block")
+
+        # Output header is identical for every same-length isolated source, so pack it once
+        self._header_bytes = self.pack_header(self.amplitudes.size * self.bytes_per_sample)
 
         # Report file information
-        data_size_mb = self.data_size / (1024 * 1024)
-        sys.stdout.write(f"[Info]  ::::  File information:\n")
-        sys.stdout.write(f"Sample Rate:        {self.sample_rate}\n")
-        sys.stdout.write(f"Bits Per Sample:    {self.bits_per_sample}\n")
-        sys.stdout.write(f"Bit Rate:           {self.bit_rate}\n")  
-        sys.stdout.write(f"Data size:          {self.data_size} ({data_size_mb:.2f} mb)\n")
-        sys.stdout.write(f"Number of samples:  {len(self.amplitudes)}\n")
-        sys.stdout.write(f"Audio Channels:     {self.audio_channels}\n\n")
+        log.info("File information:\n"
+                 "Sample Rate:        %d\n"
+                 "Bits Per Sample:    %d\n"
+                 "Bit Rate:           %d\n"
+                 "Data size:          %d (%.2f mb)\n"
+                 "Number of samples:  %d\n"
+                 "Audio Channels:     %d",
+                 self.sample_rate, self.bits_per_sample, self.bit_rate,
+                 self.data_size, self.data_size / (1024 * 1024),
+                 len(self.amplitudes), self.audio_channels)
+
+    @cached_property
+    def channels_soa(self) -> np.ndarray:
+        '''
+        Channel-major (channels, samples) copy of the amplitudes
+        Each row is contiguous, so per-channel processing streams through memory instead of striding across frames
+        Built on first access to keep the memory-mapped amplitudes lazy otherwise
+        '''
+        return np.ascontiguousarray(self.amplitudes.T)
+
+    def pack_header(self, data_size) -> bytes:
+        '''
+        Pack canonical 44 byte RIFF, fmt, and data block headers for a data block of the given size
+        The 16 byte fmt block is always plain PCM, even for extensible input
+        '''
+        return struct.pack('<4sI4s4sIHHIIHH4sI',
+                           b'RIFF', 36 + data_size, b'WAVE',
+                           b'fmt ', 16, _WAVE_FORMAT_PCM, self.audio_channels,
+                           self.sample_rate, self.byte_rate, self.block_align, self.bits_per_sample,
+                           b'data', data_size)
+
+    def _encode(self, amplitudes) -> np.ndarray:
+        '''
+        Contiguous little-endian samples in the file's native width, ready for tofile
+        A no-op view when amplitudes already match, as with decompose passthrough
+        '''
+        samples = np.ascontiguousarray(amplitudes, dtype=self.sample_dtype)
+        if self.bits_per_sample == 24:
+            # Drop the high byte of each int32 to repack as 3 byte samples
+            samples = np.ascontiguousarray(samples.view(np.uint8).reshape(-1, 4)[:, :3])
+        return samples
+
+    def iter_blocks(self, block_frames=1 << 20):
+        '''
+        Yield (start, end, amplitudes) for consecutive blocks of at most block_frames frames
+        For 8, 16, and 32 bit files blocks are views into the memory-mapped data, so only the block being used is paged in
+        24 bit files are fully decoded into memory on load, so their blocks are views of that in-memory array
+        '''
+        for start in range(0, self.num_samples, block_frames):
+            end = min(start + block_frames, self.num_samples)
+            yield start, end, self.amplitudes[start:end]
 
-    def jump_to(self, block, file) -> tuple[bytes, int]:
+    def _output_paths(self, output_directory, sources) -> dict:
+        '''
+        Map each source to its output .wav path
+        The amplitudes map the input file on disk, so an output that would overwrite the input is refused
+        '''
+        paths = {source: f'{output_directory}{source}.wav' for source in sources}
+        for path in paths.values():
+            if os.path.exists(path) and os.path.samefile(path, self.input_directory):
+                raise ValueError(f"Error: Output {path} would overwrite the input file. Choose a different output directory")
+        return paths
+
+    @staticmethod
+    def jump_to(block, file) -> tuple[bytes, int]:
         '''
         Skip through a .wav file to locate a desired block
         Returns the block id and correspoding block size
         ''' 
         SEEK_CUR = 1
-        sys.stdout.write(f"[Debug] ::::  Seeking {block} block - Status: ")
-        sys.stdout.flush()
+        log.debug("Seeking %s block", block)
+        file_size = os.fstat(file.fileno()).st_size
 
         while True:
-            block_id = file.read(4)
+            block_header = file.read(8)
+
+            # If invalid block header read, or end of file
+            if len(block_header) < 8:
+                raise ValueError(f"End of file. {block} block not found")
 
-            # If invalid block_id read, or end of file
-            if not block_id:
-                sys.stdout.write("Error\n")
-                raise ValueError("End of file. {block} block not found")
-            
-            # Read current block size
-            block_size = struct.unpack('<I', file.read(4))[0]
+            block_id, block_size = struct.unpack('<4sI', block_header)
 
             # If target
             if block_id == block:
-                sys.stdout.write("Found\n")
+                log.debug("Found %s block", block)
                 return block_id, block_size
 
             else:
+                # Odd sized blocks are followed by a pad byte
+                padded_size = block_size + (block_size & 1)
+
+                # Refuse to skip past the end of a corrupt file
+                if padded_size > file_size - file.tell():
+                    raise ValueError(f"Corrupt file. {block_id} block size of {block_size} exceeds remaining file size")
+
                 # Skip to the end of the current block
-                file.seek(block_size, SEEK_CUR)
+                file.seek(padded_size, SEEK_CUR)
     
-    def split(self, output_directory, sources) -> None:
+    def split(self, output_directory, sources, decomposer=None, workers=2) -> None:
         '''
         For each desired source, write a new .wav file containing the isolated track
+        A Decomposer is created if none is provided
+        Up to workers sources are handled at once, each with its own output buffer the size of the decoded track,
+        so isolators writing into it cost up to workers extra copies of the track in memory
+        The default of 2 lets one source's write overlap the next source's isolation
         '''
-        sys.stdout.write("[Info] =::::= Splitting track\n")
+        log.info("Splitting track")
 
         # Create decomposer object
-        decomposer = Decomposer()
+        if decomposer is None:
+            decomposer = Decomposer()
               
-        for source in sources:
-            
-            self.isolated_amplitudes = decomposer.decompose(self.amplitudes, source)
-
-            sys.stdout.write(f"[Debug] ::::  Writing to file - {output_directory}{source}.wav - Status: ")
-            sys.stdout.flush()
-            with open(f'{output_directory}{source}.wav', 'wb') as file:
-                # RIFF Block
-                file.write(b'RIFF')
-                file.write(struct.pack('<I', self.file_size))
-                file.write(b'WAVE')
-
-                # fmt Block
-                file.write(b'fmt ')
-                file.write(struct.pack('<I', self.fmt_size))
-                file.write(struct.pack('<H', self.audio_format))
-                file.write(struct.pack('<H', self.audio_channels))
-                file.write(struct.pack('<I', self.sample_rate))
-                file.write(struct.pack('<I', self.byte_rate))
-                file.write(struct.pack('<H', self.block_align))
-                file.write(struct.pack('<H', self.bits_per_sample))
-
-                # data Block
-                file.write(b'data')
-                file.write(struct.pack('<I', self.data_size))
+        # Refuse any output that is the input before opening anything for writing
+        paths = self._output_paths(output_directory, sources)
+
+        # One reusable output buffer per worker, rather than a fresh array per source
+        workers = max(1, min(len(sources), workers))
+        scratch = SimpleQueue()
+        for _ in range(workers):
+            scratch.put(np.empty(self.amplitudes.shape, dtype=self.amplitudes.dtype))
+
+        # Sources are independent, so overlap one source's write with another's isolation
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            isolated = list(executor.map(lambda source: self._emit_source(source, paths[source], decomposer, scratch), sources))
+
+        # Keep the last isolated track available to callers
+        if isolated:
+            self.isolated_amplitudes = isolated[-1]
+
+    def _emit_source(self, source, path, decomposer, scratch) -> np.ndarray:
+        '''
+        Isolate a single source and write it to its own .wav file
+        A buffer is borrowed from scratch for the isolation output and returned once written
+        Returns the isolated amplitudes
+        '''
+        out = scratch.get()
+        try:
+            isolated_amplitudes = decomposer.decompose(self.amplitudes, source, out=out)
+
+            log.debug("Writing to file - %s", path)
+            with open(path, 'wb') as file:
+                samples = self._encode(isolated_amplitudes)
+
+                # RIFF, fmt, and data block headers in one write, repacked only if the source changed length
+                if samples.nbytes == self.amplitudes.size * self.bytes_per_sample:
+                    file.write(self._header_bytes)
+                else:
+                    file.write(self.pack_header(samples.nbytes))
 
                 # Write isolated amplitudes
-                for frame in self.isolated_amplitudes:
-                    for sample in frame:
-                        file.write(struct.pack(self.sample_format, int(sample)))
+                samples.tofile(file)
                 file.flush()
-                
+
+            # Report file confirmation
+            log.debug("Wrote %s", path)
+            return isolated_amplitudes
+        finally:
+            scratch.put(out)
+
+    def split_streaming(self, output_directory, sources, block_frames=1 << 20, decomposer=None) -> None:
+        '''
+        For each desired source, write a new .wav file containing the isolated track, one block at a time
+        For 8, 16, and 32 bit files memory use is bounded by block_frames regardless of input length
+        24 bit files are not bounded, as their amplitudes are fully decoded into memory on load
+        A Decomposer is created if none is provided
+        '''
+        SEEK_SET = 0
+        log.info("Splitting track in blocks of %d frames", block_frames)
+
+        # Create decomposer object
+        if decomposer is None:
+            decomposer = Decomposer()
+
+        # Each source owns one open output file
+        sources = list(dict.fromkeys(sources))
+        paths = self._output_paths(output_directory, sources)
+
+        # One reusable output buffer shared by every block and source
+        scratch = np.empty((min(block_frames, self.num_samples), self.audio_channels), dtype=self.amplitudes.dtype)
+
+        with ExitStack() as stack:
+            # Headers are written with unknown (0xFFFFFFFF) sizes and patched once the final size is known,
+            # so a run that fails partway leaves a partial file that readers clamp to the data present
+            placeholder_header = bytearray(self.pack_header(0))
+            struct.pack_into('<I', placeholder_header, 4, 0xFFFFFFFF)
+            struct.pack_into('<I', placeholder_header, 40, 0xFFFFFFFF)
+            files = {}
+            for source in sources:
+                log.debug("Writing to file - %s", paths[source])
+                files[source] = stack.enter_context(open(paths[source], 'wb'))
+                files[source].write(placeholder_header)
+            data_sizes = dict.fromkeys(sources, 0)
+
+            # Each block is read once and isolated into every source
+            for start, end, block in self.iter_blocks(block_frames):
+                for source in sources:
+                    samples = self._encode(decomposer.decompose(block, source, out=scratch[:end - start]))
+                    if data_sizes[source] + samples.nbytes > 0xFFFFFFFF - 36:
+                        raise ValueError(f"Error: {source}.wav exceeds the 4 GiB wav size limit")
+                    samples.tofile(files[source])
+                    data_sizes[source] += samples.nbytes
+
+            # Patch the RIFF and data block sizes
+            for source, file in files.items():
+                file.seek(4, SEEK_SET)
+                file.write(struct.pack('<I', 36 + data_sizes[source]))
+                file.seek(40, SEEK_SET)
+                file.write(struct.pack('<I', data_sizes[source]))
+                file.flush()
+
                 # Report file confirmation
-                sys.stdout.write(f"Success\n")
\ No newline at end of file
+                log.debug("Wrote %s", paths[source])